@@ -1,33 +1,37 @@
 # app.py
 from __future__ import annotations
 
+import asyncio
+import functools
 import os
 import re
 import secrets
+import sqlite3
 import time
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import uuid
 from pathlib import Path
 
 import csv
 import io
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 from urllib.parse import urlparse
 
 import qrcode
+import qrcode.image.svg
 from io import BytesIO
-import base64
 
 from fastapi import FastAPI, Form, Request, Query
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi import HTTPException
 
 from passlib.hash import pbkdf2_sha256
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 
-from db import get_conn, init_db, \
+from db import get_conn, open_stream_conn, init_db, fts_enabled, FTS_MIN_QUERY_LEN, PoolTimeout, \
     list_containers, list_categories, list_subcategories, \
     ensure_container, ensure_category, ensure_subcategory
 
@@ -36,9 +40,11 @@ APP_TITLE = "Electronics Inventory"
 APP_VERSION = "2.1"
 
 BASE_URL = os.environ.get("INVENTORY_BASE_URL", "http://127.0.0.1:8001").rstrip("/")
+BASE_URL_PARSED = urlparse(BASE_URL)
 
 SESSION_COOKIE_NAME = "inventory_session"
 SESSION_TTL_SECONDS = 24 * 60 * 60
+SESSION_GC_INTERVAL_SECONDS = 5 * 60
 
 STATIC_DIR = Path(__file__).with_name("static")
 
@@ -47,9 +53,17 @@ def _env_truthy(name: str) -> bool:
     return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "y", "on")
 
 
+# Intended for fully-local setups only. Do NOT use on internet-exposed deployments.
+# Read once at import; changing it requires a restart.
+_AUTH_DISABLED = _env_truthy("INVENTORY_DISABLE_AUTH")
+
+
 def _auth_disabled() -> bool:
-    # Intended for fully-local setups only. Do NOT use on internet-exposed deployments.
-    return _env_truthy("INVENTORY_DISABLE_AUTH")
+    return _AUTH_DISABLED
+
+# Reachable without a session (exact paths / path prefixes)
+_OPEN_PATHS = frozenset({"/login", "/favicon.ico", "/logout"})
+_OPEN_PREFIXES = ("/static/",)
 
 ALLOWED_EDIT_FIELDS = {
     "category",
@@ -94,17 +108,25 @@ def _parse_stock_levels(text: str) -> tuple[int | None, int | None]:
     return hi, lo
 
 
-def _available_label_presets() -> List[str]:
-    static_dir = Path(__file__).with_name("static")
+_PRESET_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+
+@functools.lru_cache(maxsize=1)
+def _presets_cached(mtime_ns: int) -> tuple[str, ...]:
+    # Keyed on the static dir mtime, so adding/removing a preset CSS invalidates it
     presets: List[str] = []
-    for css_file in static_dir.glob("avery_*.css"):
+    for css_file in STATIC_DIR.glob("avery_*.css"):
         name = css_file.stem
         if not name.startswith("avery_"):
             continue
         preset = name[len("avery_"):]
-        if preset and re.fullmatch(r"[A-Za-z0-9_-]+", preset):
+        if preset and _PRESET_RE.fullmatch(preset):
             presets.append(preset)
-    return sorted(set(presets))
+    return tuple(sorted(set(presets)))
+
+
+def _available_label_presets() -> List[str]:
+    return list(_presets_cached(os.stat(STATIC_DIR).st_mtime_ns))
 
 
 def _normalize_static_media_path(field: str, value: str) -> str:
@@ -181,6 +203,11 @@ def _normalize_static_media_path(field: str, value: str) -> str:
     return f"/static/{subdir}/{raw}"
 
 
+# Verified against when INVENTORY_PASS_HASH is missing, so every login attempt
+# pays the same pbkdf2 cost regardless of configuration or which check fails.
+_DUMMY_PASS_HASH = pbkdf2_sha256.hash(secrets.token_urlsafe(32))
+
+
 def _auth_config() -> tuple[str, str]:
     # Read at request-time so runtime env changes (service env, docker env, etc.) are respected.
     return (
@@ -193,26 +220,45 @@ def _now_ts() -> int:
     return int(time.time())
 
 
+def _now_text() -> str:
+    # Same UTC text format as SQLite's datetime('now'), computed once in Python
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+
 def _cleanup_expired_sessions(now_ts: int) -> None:
     with get_conn() as conn:
         conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now_ts,))
 
 
+# One PRIMARY KEY lookup per authenticated request; kept as a constant so the
+# pooled connections' statement cache always hits.
+_SQL_SESSION_LOOKUP = (
+    "SELECT token, username, expires_at FROM sessions WHERE token = ? AND expires_at > ?"
+)
+
+
 def _get_valid_session(token: str) -> Optional[Dict[str, Any]]:
     if not token:
         return None
 
+    # Expired rows are purged by _session_gc_loop; the lookup itself stays read-only
     now_ts = _now_ts()
     with get_conn() as conn:
-        conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now_ts,))
-        row = conn.execute(
-            "SELECT token, username, expires_at FROM sessions WHERE token = ? AND expires_at > ?",
-            (token, now_ts),
-        ).fetchone()
+        row = conn.execute(_SQL_SESSION_LOOKUP, (token, now_ts)).fetchone()
 
     return dict(row) if row is not None else None
 
 
+async def _session_gc_loop() -> None:
+    while True:
+        await asyncio.sleep(SESSION_GC_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(_cleanup_expired_sessions, _now_ts())
+        except Exception:
+            # Best effort; try again on the next tick
+            pass
+
+
 def _create_session(username: str) -> tuple[str, int]:
     token = secrets.token_urlsafe(32)
     now_ts = _now_ts()
@@ -237,6 +283,18 @@ def _delete_session(token: str) -> None:
 app = FastAPI()
 
 
+def _busy_response() -> HTMLResponse:
+    return HTMLResponse(
+        "Server busy, please try again.", status_code=503, headers={"Retry-After": "5"}
+    )
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout) -> HTMLResponse:
+    # All pooled DB connections stayed busy: fail fast instead of queueing forever
+    return _busy_response()
+
+
 @app.middleware("http")
 async def session_auth_middleware(request: Request, call_next):
     if _auth_disabled():
@@ -246,17 +304,22 @@ async def session_auth_middleware(request: Request, call_next):
     path = request.url.path
 
     # Allow unauthenticated access
-    if path == "/login" or path == "/favicon.ico" or path.startswith("/static/"):
+    if path in _OPEN_PATHS or path.startswith(_OPEN_PREFIXES):
         return await call_next(request)
 
     token = request.cookies.get(SESSION_COOKIE_NAME, "")
-    session = _get_valid_session(token)
+    # SQLite calls block; keep them off the event loop
+    try:
+        session = await run_in_threadpool(_get_valid_session, token)
+    except PoolTimeout:
+        # Raised outside the route stack, so the exception handler doesn't see it
+        return _busy_response()
     if session is not None:
         request.state.user = session.get("username")
         return await call_next(request)
 
     accept = request.headers.get("accept", "")
-    wants_html = ("text/html" in accept) or ("*/*" in accept) or (accept.strip() == "")
+    wants_html = not accept.strip() or "text/html" in accept or "*/*" in accept
     if wants_html:
         return RedirectResponse(url="/login", status_code=303)
 
@@ -264,14 +327,44 @@ async def session_auth_middleware(request: Request, call_next):
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Compiled template bytecode is persisted on disk so restarts/workers skip the
+# parse+compile step. Template mtimes are only checked in dev (INVENTORY_DEV=1).
 templates = Environment(
     loader=FileSystemLoader("templates"),
     autoescape=select_autoescape(["html", "xml"]),
+    bytecode_cache=FileSystemBytecodeCache(),
+    auto_reload=_env_truthy("INVENTORY_DEV"),
+    cache_size=400,
 )
 
+def _localtime(value: Any) -> str:
+    """Format a stored UTC timestamp (SQLite text or unix seconds) in server local time.
+
+    Done at render time instead of datetime(..., 'localtime') in every SELECT,
+    so only rows that are actually shown pay for the conversion.
+    """
+    if value is None or value == "":
+        return ""
+    try:
+        if isinstance(value, (int, float)):
+            dt = datetime.fromtimestamp(value, tz=timezone.utc)
+        else:
+            dt = datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return str(value)
+    return dt.astimezone().strftime("%Y-%m-%d %H:%M:%S")
+
+
+templates.filters["localtime"] = _localtime
+
 templates.globals["app_title"] = APP_TITLE
 templates.globals["app_version"] = APP_VERSION
 
+# Hot HTMX partials, bound once to skip the Environment lookup per request
+TPL_ROW = templates.get_template("_row.html")
+TPL_TABLE = templates.get_template("_table.html")
+TPL_EDIT_CELL = templates.get_template("_edit_cell.html")
+
 def render(template_name: str, **context: Any) -> HTMLResponse:
     tpl = templates.get_template(template_name)
     return HTMLResponse(tpl.render(**context))
@@ -286,6 +379,20 @@ def render_with_status(template_name: str, status_code: int, **context: Any) ->
 def _startup() -> None:
     init_db()
 
+    # Pre-warm the template cache so the first request doesn't pay compile cost
+    for name in templates.list_templates(extensions=["html"]):
+        templates.get_template(name)
+
+
+@app.on_event("startup")
+async def _start_session_gc() -> None:
+    app.state.session_gc = asyncio.create_task(_session_gc_loop())
+
+
+@app.on_event("shutdown")
+async def _stop_session_gc() -> None:
+    app.state.session_gc.cancel()
+
 
 @app.get("/login", response_class=HTMLResponse)
 def login_get(request: Request) -> HTMLResponse:
@@ -304,7 +411,14 @@ def login_post(
         return RedirectResponse(url="/", status_code=303)
 
     auth_user, auth_pass_hash = _auth_config()
-    if not auth_user or not auth_pass_hash:
+
+    # Single constant-time path: always run both checks and combine the results
+    # without short-circuiting, so timing doesn't reveal which one failed.
+    user_ok = secrets.compare_digest((username or "").encode(), auth_user.encode())
+    pass_ok = pbkdf2_sha256.verify((password or ""), auth_pass_hash or _DUMMY_PASS_HASH)
+    configured = bool(auth_user) & bool(auth_pass_hash)
+
+    if not configured:
         return render_with_status(
             "login.html",
             500,
@@ -313,10 +427,7 @@ def login_post(
             error="Auth not configured on server (set INVENTORY_USER and INVENTORY_PASS_HASH)",
         )
 
-    user_ok = secrets.compare_digest((username or ""), auth_user)
-    pass_ok = pbkdf2_sha256.verify((password or ""), auth_pass_hash)
-
-    if not (user_ok and pass_ok):
+    if not (user_ok & pass_ok):
         return render(
             "login.html",
             request=request,
@@ -324,14 +435,12 @@ def login_post(
             error="Invalid username or password",
         )
 
-    token, expires_ts = _create_session(username=auth_user)
+    token, _ = _create_session(username=auth_user)
     resp = RedirectResponse(url="/", status_code=303)
-    expires_dt = datetime.fromtimestamp(expires_ts, tz=timezone.utc)
     resp.set_cookie(
         key=SESSION_COOKIE_NAME,
         value=token,
         max_age=SESSION_TTL_SECONDS,
-        expires=expires_dt,
         httponly=True,
         secure=True,
         samesite="lax",
@@ -354,23 +463,24 @@ def logout(request: Request):
 async def favicon():
     return FileResponse("static/favicon.ico")
 
-def fetch_parts(
+def _parts_query(
     q: str = "",
     category: str = "",
     container_id: str = "",
     limit: int = 500,
-) -> List[Dict[str, Any]]:
-    sql = (
-        "SELECT *, "
-        "datetime(created_at, 'localtime') AS created_at_local, "
-        "datetime(updated_at, 'localtime') AS updated_at_local "
-        "FROM parts WHERE 1=1"
-    )
+    columns: str = "*",
+) -> tuple[str, List[Any]]:
+    sql = f"SELECT {columns} FROM parts WHERE 1=1"
     params: List[Any] = []
 
-    if q.strip():
+    needle = q.strip()
+    if needle and fts_enabled() and len(needle) >= FTS_MIN_QUERY_LEN:
+        # Trigram index lookup; the needle is quoted as one FTS phrase (substring match)
+        sql += " AND id IN (SELECT rowid FROM parts_fts WHERE parts_fts MATCH ?)"
+        params.append('"' + needle.replace('"', '""') + '"')
+    elif needle:
         sql += " AND (description LIKE ? OR notes LIKE ? OR subcategory LIKE ? OR package LIKE ? OR container_id LIKE ?)"
-        pat = f"%{q.strip()}%"
+        pat = f"%{needle}%"
         params += [pat, pat, pat, pat, pat]
 
     if category.strip():
@@ -384,9 +494,19 @@ def fetch_parts(
     sql += " ORDER BY updated_at DESC, id DESC LIMIT ?"
     params.append(limit)
 
+    return sql, params
+
+
+def fetch_parts(
+    q: str = "",
+    category: str = "",
+    container_id: str = "",
+    limit: int = 500,
+) -> List[sqlite3.Row]:
+    # Rows go to Jinja as-is (name access works on sqlite3.Row); no per-row dict copies
+    sql, params = _parts_query(q=q, category=category, container_id=container_id, limit=limit)
     with get_conn() as conn:
-        rows = conn.execute(sql, params).fetchall()
-    return [dict(r) for r in rows]
+        return conn.execute(sql, params).fetchall()
 
 
 def fetch_trash(
@@ -394,8 +514,8 @@ def fetch_trash(
     category: str = "",
     container_id: str = "",
     limit: int = 500,
-) -> List[Dict[str, Any]]:
-    sql = "SELECT *, datetime(deleted_at, 'unixepoch', 'localtime') AS deleted_at_human FROM parts_trash WHERE 1=1"
+) -> List[sqlite3.Row]:
+    sql = "SELECT * FROM parts_trash WHERE 1=1"
     params: List[Any] = []
 
     if q.strip():
@@ -415,8 +535,7 @@ def fetch_trash(
     params.append(limit)
 
     with get_conn() as conn:
-        rows = conn.execute(sql, params).fetchall()
-    return [dict(r) for r in rows]
+        return conn.execute(sql, params).fetchall()
 
 
 def _trash_parts(where_sql: str, params: List[Any], deleted_by: str) -> str:
@@ -449,6 +568,7 @@ def _trash_parts(where_sql: str, params: List[Any], deleted_by: str) -> str:
         )
         conn.execute("COMMIT")
 
+    _invalidate_filter_facets()
     return batch_id
 
 
@@ -461,38 +581,66 @@ def fetch_distinct(field: str) -> List[str]:
 
 
 
-def list_categories_in_use():
+def list_filters_in_use() -> tuple[List[str], List[str]]:
+    """Return (categories, containers) referenced by parts in one round trip.
+
+    Both halves are answered from the category/container_id indexes.
+    """
     with get_conn() as conn:
         rows = conn.execute(
             """
-            SELECT DISTINCT TRIM(category) AS name
+            SELECT 'c' AS kind, TRIM(category) AS v
             FROM parts
             WHERE category IS NOT NULL AND TRIM(category) <> ''
-            ORDER BY name
-            """
-        ).fetchall()
-    return [r["name"] if hasattr(r, "keys") else r[0] for r in rows]
-
-
-def list_containers_in_use():
-    with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT DISTINCT TRIM(container_id) AS code
+            UNION
+            SELECT 'k' AS kind, TRIM(container_id) AS v
             FROM parts
             WHERE container_id IS NOT NULL AND TRIM(container_id) <> ''
-            ORDER BY code
+            ORDER BY kind, v
             """
         ).fetchall()
-    return [r["code"] if hasattr(r, "keys") else r[0] for r in rows]
+    categories = [r[1] for r in rows if r[0] == "c"]
+    containers = [r[1] for r in rows if r[0] == "k"]
+    return categories, containers
+
+
+# Bumped after every write that can change the facets below (see _filter_facets)
+_facets_version = 0
+
+
+def _invalidate_filter_facets() -> None:
+    global _facets_version
+    _facets_version += 1
 
 
+@functools.lru_cache(maxsize=1)
+def _filter_facets(version: int) -> tuple[List[str], List[str], str]:
+    """Return (categories, containers, datalists_html) for the filter/add forms.
 
-def qr_base64(text: str) -> str:
-    img = qrcode.make(text)
+    `version` is only the cache key: consecutive page loads reuse the result
+    (no DB queries, no datalist rendering) until a write bumps it.
+    """
+    categories, containers = list_filters_in_use()
+    datalists_html = templates.get_template("_datalists.html").render(
+        categories=categories,
+        containers=containers,
+        subcategories=list_subcategories(),
+    )
+    return categories, containers, datalists_html
+
+
+def filter_facets() -> tuple[List[str], List[str], str]:
+    return _filter_facets(_facets_version)
+
+
+@functools.lru_cache(maxsize=512)
+def qr_svg_bytes(text: str) -> bytes:
+    # Label URLs are deterministic, so each container's QR is built only once.
+    # SVG skips PIL rasterization + zlib and prints sharper than a PNG.
+    img = qrcode.make(text, image_factory=qrcode.image.svg.SvgPathImage)
     buf = BytesIO()
-    img.save(buf, "PNG")   # ← positional argument, not keyword
-    return base64.b64encode(buf.getvalue()).decode()
+    img.save(buf)
+    return buf.getvalue()
 
 
 
@@ -508,11 +656,7 @@ def index(
 
     # IMPORTANT:
     # Search filters must reflect real inventory, not lookup tables
-    categories = list_categories_in_use()
-    containers = list_containers_in_use()
-
-    # Keep subcategories for datalist suggestions if you already had this
-    subcategories = list_subcategories() if "list_subcategories" in globals() else []
+    categories, containers, datalists_html = filter_facets()
 
     return render(
         "index.html",
@@ -524,14 +668,14 @@ def index(
         container_id=container_id,
         categories=categories,
         containers=containers,
-        subcategories=subcategories,
+        datalists_html=datalists_html,
     )
 
 
 @app.get("/partials/table", response_class=HTMLResponse)
 def partial_table(q: str = "", category: str = "", container_id: str = "") -> HTMLResponse:
     parts = fetch_parts(q=q, category=category, container_id=container_id)
-    return render("_table.html", parts=parts)
+    return HTMLResponse(TPL_TABLE.render(parts=parts))
 
 
 @app.post("/parts", response_class=HTMLResponse)
@@ -557,6 +701,7 @@ def add_part(
     ensure_subcategory(subcategory)
 
     part_uuid = str(uuid.uuid4())
+    now = _now_text()
 
     with get_conn() as conn:
         conn.execute(
@@ -565,7 +710,7 @@ def add_part(
                 uuid, category, subcategory, description, package, container_id, quantity, notes,
                 datasheet_url, pinout_url, created_at, updated_at
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'), datetime('now'))
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
             (
                 part_uuid,
@@ -578,12 +723,16 @@ def add_part(
                 notes.strip(),
                 datasheet_url.strip(),
                 pinout_url.strip(),
+                now,
+                now,
             ),
         )
 
+    _invalidate_filter_facets()
+
     # Return updated table (HTMX target)
     parts = fetch_parts()
-    return render("_table.html", parts=parts)
+    return HTMLResponse(TPL_TABLE.render(parts=parts))
 
 
 @app.post("/parts/{part_uuid}/delete", response_class=HTMLResponse)
@@ -591,34 +740,29 @@ def delete_part(request: Request, part_uuid: str) -> HTMLResponse:
     deleted_by = getattr(request.state, "user", "") or ""
     _trash_parts("uuid = ?", [part_uuid], deleted_by=deleted_by)
 
+    # Parsed once; both branches below only need the path (and the host for redirects)
+    try:
+        ref = urlparse(request.headers.get("referer", ""))
+    except ValueError:
+        ref = None
+
     # HTMX main-table delete expects the table fragment back.
     if request.headers.get("hx-request", "").lower() == "true":
-        referer = request.headers.get("referer", "")
-
         # If the delete was triggered from a container page, keep that view filtered.
-        try:
-            ref = urlparse(referer)
-            if ref.path.startswith("/containers/") and not ref.path.startswith("/containers/labels"):
-                code = ref.path[len("/containers/"):].strip("/")
-                if code:
-                    parts = fetch_parts(container_id=code)
-                    return render("_table.html", parts=parts)
-        except Exception:
-            pass
+        if ref is not None and ref.path.startswith("/containers/") and not ref.path.startswith("/containers/labels"):
+            code = ref.path[len("/containers/"):].strip("/")
+            if code:
+                parts = fetch_parts(container_id=code)
+                return HTMLResponse(TPL_TABLE.render(parts=parts))
 
         parts = fetch_parts()
-        return render("_table.html", parts=parts)
+        return HTMLResponse(TPL_TABLE.render(parts=parts))
 
-    # Non-HTMX (e.g., container view): redirect back to where the user came from.
-    referer = request.headers.get("referer", "")
+    # Non-HTMX (e.g., container view): redirect back to where the user came from,
+    # but only for same-site referers (our configured base URL or the request host).
     dest = "/"
-    try:
-        ref = urlparse(referer)
-        base = urlparse(str(request.base_url))
-        if ref.scheme == base.scheme and ref.netloc == base.netloc and ref.path:
-            dest = ref.path + (("?" + ref.query) if ref.query else "")
-    except Exception:
-        dest = "/"
+    if ref is not None and ref.path and ref.netloc in (BASE_URL_PARSED.netloc, request.headers.get("host", "")):
+        dest = ref.path + (("?" + ref.query) if ref.query else "")
 
     return RedirectResponse(url=dest, status_code=303)
 
@@ -630,9 +774,7 @@ def edit_cell(part_uuid: str, field: str) -> HTMLResponse:
     with get_conn() as conn:
         row = conn.execute(
             """
-            SELECT *,
-                   datetime(created_at, 'localtime') AS created_at_local,
-                   datetime(updated_at, 'localtime') AS updated_at_local
+            SELECT *
             FROM parts
             WHERE uuid = ?
             """,
@@ -644,8 +786,8 @@ def edit_cell(part_uuid: str, field: str) -> HTMLResponse:
 
     containers = list_containers()
     categories = list_categories()
-    return render("_edit_cell.html", part=dict(row), field=field,
-                  containers=containers, categories=categories)
+    return HTMLResponse(TPL_EDIT_CELL.render(part=row, field=field,
+                                             containers=containers, categories=categories))
 
 
 @app.post("/parts/{part_uuid}/edit/{field}", response_class=HTMLResponse)
@@ -693,46 +835,37 @@ def save_cell(
 
     with get_conn() as conn:
         if field == "quantity":
-            if keep_levels:
-                current = conn.execute(
-                    "SELECT stock_ok_min, stock_warn_min FROM parts WHERE uuid = ?",
-                    (part_uuid,),
-                ).fetchone()
-                if current is not None:
-                    ok_min = current[0]
-                    warn_min = current[1]
-                else:
-                    ok_min, warn_min = None, None
-
-            conn.execute(
+            # On unparsable stock levels (keep_levels) the stored levels stay untouched
+            row = conn.execute(
                 """
                 UPDATE parts
-                SET quantity = ?, stock_ok_min = ?, stock_warn_min = ?, updated_at = datetime('now')
+                SET quantity = ?,
+                    stock_ok_min = CASE WHEN ? THEN stock_ok_min ELSE ? END,
+                    stock_warn_min = CASE WHEN ? THEN stock_warn_min ELSE ? END,
+                    updated_at = datetime('now')
                 WHERE uuid = ?
+                RETURNING *
                 """,
-                (q_int, ok_min, warn_min, part_uuid),
-            )
+                (q_int, keep_levels, ok_min, keep_levels, warn_min, part_uuid),
+            ).fetchone()
         else:
-            conn.execute(
-                f"UPDATE parts SET {field} = ?, updated_at = datetime('now') WHERE uuid = ?",
+            row = conn.execute(
+                f"""
+                UPDATE parts SET {field} = ?, updated_at = datetime('now')
+                WHERE uuid = ?
+                RETURNING *
+                """,
                 (value, part_uuid),
-            )
-        row = conn.execute(
-            """
-            SELECT *,
-                   datetime(created_at, 'localtime') AS created_at_local,
-                   datetime(updated_at, 'localtime') AS updated_at_local
-            FROM parts
-            WHERE uuid = ?
-            """,
-            (part_uuid,),
-        ).fetchone()
+            ).fetchone()
+
+    if field in ("category", "container_id", "subcategory"):
+        _invalidate_filter_facets()
 
     if row is None:
         return HTMLResponse("Not found", status_code=404)
 
     # Return the rendered row so the table updates cleanly
-    return render("_row.html", part=dict(row))
+    return HTMLResponse(TPL_ROW.render(part=row))
 
 
 @app.get("/parts/{part_uuid}/row", response_class=HTMLResponse)
@@ -740,9 +873,7 @@ def get_row(part_uuid: str) -> HTMLResponse:
     with get_conn() as conn:
         row = conn.execute(
             """
-            SELECT *,
-                   datetime(created_at, 'localtime') AS created_at_local,
-                   datetime(updated_at, 'localtime') AS updated_at_local
+            SELECT *
             FROM parts
             WHERE uuid = ?
             """,
@@ -752,52 +883,32 @@ def get_row(part_uuid: str) -> HTMLResponse:
     if row is None:
         return HTMLResponse("Not found", status_code=404)
 
-    return render("_row.html", part=dict(row))
+    return HTMLResponse(TPL_ROW.render(part=row))
 
 
 @app.post("/parts/{part_uuid}/quantity_delta", response_class=HTMLResponse)
 def quantity_delta(part_uuid: str, delta: int = Form(0)) -> HTMLResponse:
-    try:
-        d = int(delta)
-    except Exception:
-        d = 0
+    # `delta` is already an int (FastAPI rejects non-integers with 422).
     # Accept aggregated deltas from the UI (e.g. rapid clicks batched client-side),
     # but clamp to a reasonable range to prevent accidental huge jumps.
-    if d > 50:
-        d = 50
-    elif d < -50:
-        d = -50
+    d = max(min(delta, 50), -50)
 
+    # Clamp at zero in SQL: one statement instead of SELECT + UPDATE + SELECT
     with get_conn() as conn:
-        row = conn.execute(
-            "SELECT quantity FROM parts WHERE uuid = ?",
-            (part_uuid,),
-        ).fetchone()
-        if row is None:
-            return HTMLResponse("Not found", status_code=404)
-
-        current_qty = int(row[0] or 0)
-        new_qty = max(current_qty + d, 0)
-        conn.execute(
-            "UPDATE parts SET quantity = ?, updated_at = datetime('now') WHERE uuid = ?",
-            (new_qty, part_uuid),
-        )
-
         updated = conn.execute(
             """
-            SELECT *,
-                   datetime(created_at, 'localtime') AS created_at_local,
-                   datetime(updated_at, 'localtime') AS updated_at_local
-            FROM parts
+            UPDATE parts
+            SET quantity = MAX(COALESCE(quantity, 0) + ?, 0), updated_at = datetime('now')
             WHERE uuid = ?
+            RETURNING *
             """,
-            (part_uuid,),
+            (d, part_uuid),
         ).fetchone()
 
     if updated is None:
         return HTMLResponse("Not found", status_code=404)
 
-    return render("_row.html", part=dict(updated))
+    return HTMLResponse(TPL_ROW.render(part=updated))
 
 
 @app.get("/restore", response_class=HTMLResponse)
@@ -808,8 +919,7 @@ def restore_page(
     container_id: str = "",
 ) -> HTMLResponse:
     items = fetch_trash(q=q, category=category, container_id=container_id)
-    categories = list_categories_in_use()
-    containers = list_containers_in_use()
+    categories, containers, _ = filter_facets()
     return render(
         "restore.html",
         request=request,
@@ -824,8 +934,12 @@ def restore_page(
     )
 
 
+# Max bound parameters per IN (...) batch
+_SQL_IN_CHUNK = 500
+
+
 @app.post("/restore", response_class=HTMLResponse)
-async def restore_post(
+def restore_post(
     request: Request,
     action: str = Form("selected"),
     q: str = Form(""),
@@ -836,12 +950,15 @@ async def restore_post(
     # Determine which trash rows to target
     if action in ("filter", "delete_filter"):
         rows = fetch_trash(q=q, category=category, container_id=container_id, limit=100000)
-        target_uuids = [r.get("uuid", "") for r in rows if r.get("uuid")]
+        target_uuids = [r["uuid"] for r in rows if r["uuid"]]
     else:
-        target_uuids = [u for u in uuid if u]
+        # De-duplicated: the per-uuid statements below must not run twice for
+        # one part (a second INSERT ... SELECT would hit idx_parts_uuid)
+        target_uuids = list(dict.fromkeys(u for u in uuid if u))
 
     if not target_uuids:
         items = fetch_trash(q=q, category=category, container_id=container_id)
+        categories, containers, _ = filter_facets()
         return render(
             "restore.html",
             request=request,
@@ -850,74 +967,83 @@ async def restore_post(
             q=q,
             category=category,
             container_id=container_id,
-            categories=list_categories_in_use(),
-            containers=list_containers_in_use(),
+            categories=categories,
+            containers=containers,
             error="Nothing selected",
         )
 
+    # One prepared single-row statement reused via executemany; no giant IN (...)
+    # lists to re-parse and no risk of hitting SQLITE_MAX_VARIABLE_NUMBER.
+    uuid_params = [(u,) for u in target_uuids]
+
     # Permanent delete from trash
     if action in ("delete_filter", "delete_selected"):
         with get_conn() as conn:
-            placeholders = ",".join(["?"] * len(target_uuids))
-            conn.execute(
-                f"DELETE FROM parts_trash WHERE uuid IN ({placeholders})",
-                target_uuids,
-            )
+            conn.execute("BEGIN")
+            conn.executemany("DELETE FROM parts_trash WHERE uuid = ?", uuid_params)
+            conn.execute("COMMIT")
         return RedirectResponse(url="/restore", status_code=303)
 
     with get_conn() as conn:
-        placeholders = ",".join(["?"] * len(target_uuids))
-
-        existing = conn.execute(
-            f"SELECT uuid FROM parts WHERE uuid IN ({placeholders})",
-            target_uuids,
-        ).fetchall()
-        if existing:
-            items = fetch_trash(q=q, category=category, container_id=container_id)
-            return render(
-                "restore.html",
-                request=request,
-                title=f"{APP_TITLE}",
-                items=items,
-                q=q,
-                category=category,
-                container_id=container_id,
-                categories=list_categories_in_use(),
-                containers=list_containers_in_use(),
-                error="Some items already exist in inventory and cannot be restored again",
+        existing = False
+        # Fixed-size IN batches so SQLite can reuse the prepared statement
+        for i in range(0, len(target_uuids), _SQL_IN_CHUNK):
+            batch = target_uuids[i:i + _SQL_IN_CHUNK]
+            placeholders = ",".join(["?"] * len(batch))
+            if conn.execute(
+                f"SELECT 1 FROM parts WHERE uuid IN ({placeholders}) LIMIT 1",
+                batch,
+            ).fetchone():
+                existing = True
+                break
+
+        if not existing:
+            now = _now_text()
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO parts(
+                    uuid, category, subcategory, description, package, container_id, quantity, stock_ok_min, stock_warn_min, notes,
+                    image_url, datasheet_url, pinout_url, pinout_image_url, created_at, updated_at
+                )
+                SELECT
+                    uuid, category, subcategory, description, package, container_id, quantity, stock_ok_min, stock_warn_min, notes,
+                    image_url, datasheet_url, pinout_url, pinout_image_url,
+                    COALESCE(created_at, updated_at, ?),
+                    ?
+                FROM parts_trash
+                WHERE uuid = ?
+                """,
+                [(now, now, u) for (u,) in uuid_params],
             )
+            conn.executemany("DELETE FROM parts_trash WHERE uuid = ?", uuid_params)
+            conn.execute("COMMIT")
 
-        conn.execute("BEGIN")
-        conn.execute(
-            f"""
-            INSERT INTO parts(
-                uuid, category, subcategory, description, package, container_id, quantity, stock_ok_min, stock_warn_min, notes,
-                image_url, datasheet_url, pinout_url, pinout_image_url, created_at, updated_at
-            )
-            SELECT
-                uuid, category, subcategory, description, package, container_id, quantity, stock_ok_min, stock_warn_min, notes,
-                image_url, datasheet_url, pinout_url, pinout_image_url,
-                COALESCE(created_at, updated_at, datetime('now')),
-                datetime('now')
-            FROM parts_trash
-            WHERE uuid IN ({placeholders})
-            """,
-            target_uuids,
-        )
-        conn.execute(
-            f"DELETE FROM parts_trash WHERE uuid IN ({placeholders})",
-            target_uuids,
+    if not existing:
+        _invalidate_filter_facets()
+
+    # Render after releasing the pooled connection (fetch_trash etc. borrow their own)
+    if existing:
+        items = fetch_trash(q=q, category=category, container_id=container_id)
+        categories, containers, _ = filter_facets()
+        return render(
+            "restore.html",
+            request=request,
+            title=f"{APP_TITLE}",
+            items=items,
+            q=q,
+            category=category,
+            container_id=container_id,
+            categories=categories,
+            containers=containers,
+            error="Some items already exist in inventory and cannot be restored again",
         )
-        conn.execute("COMMIT")
 
     return RedirectResponse(url="/restore", status_code=303)
 
 
 @app.get("/export.csv")
 def export_csv(q: str = "", category: str = "", container_id: str = "") -> StreamingResponse:
-    parts = fetch_parts(q=q, category=category, container_id=container_id, limit=100000)
-
-    buf = io.StringIO()
     fieldnames = [
         "category",
         "subcategory",
@@ -934,19 +1060,51 @@ def export_csv(q: str = "", category: str = "", container_id: str = "") -> Strea
         "updated_at",
         "uuid",
     ]
-    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction="ignore")
+    # Select exactly the exported columns, in order, so rows can be written as plain tuples
+    sql, params = _parts_query(
+        q=q, category=category, container_id=container_id, limit=100000,
+        columns=", ".join(fieldnames),
+    )
+
+    def iter_csv() -> Iterator[str]:
+        # Stream straight from the cursor in batches: memory stays flat and the
+        # first bytes go out as soon as the query yields rows.
+        buf = io.StringIO()
+        writer = csv.writer(buf)
 
-    writer.writeheader()
-    writer.writerows(parts)
-    buf.seek(0)
+        def drain() -> str:
+            chunk = buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+            return chunk
+
+        writer.writerow(fieldnames)
+        yield drain()
+
+        # Own (non-pooled) connection: it stays open across every yield, i.e. for
+        # as long as the client takes to read, and must not starve the pool.
+        conn = open_stream_conn()
+        try:
+            cur = conn.cursor()
+            cur.row_factory = None  # plain tuples; no sqlite3.Row per row
+            cur.arraysize = 1000
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany()
+                if not rows:
+                    break
+                writer.writerows(rows)
+                yield drain()
+        finally:
+            conn.close()
 
     headers = {"Content-Disposition": "attachment; filename=inventory_export.csv"}
-    return StreamingResponse(iter([buf.getvalue()]), media_type="text/csv", headers=headers)
+    return StreamingResponse(iter_csv(), media_type="text/csv", headers=headers)
 
 
 @app.get("/containers/labels", response_class=HTMLResponse)
 def container_labels(request: Request) -> HTMLResponse:
-    containers = list_containers_in_use()
+    _, containers, _ = filter_facets()
     presets = _available_label_presets() or ["3348", "3425", "3666"]
 
     return render(
@@ -984,10 +1142,10 @@ async def print_labels(
     for c in code:
         # Asset label: container + QR
         if mode in ("asset", "both"):
+            # QR image is served (and browser-cached) by /qr/{code}.svg
             labels.append({
                 "type": "asset",
                 "code": c,
-                "qr": qr_base64(f"{BASE_URL}/containers/{c}")
             })
 
         # Content label: container + free text entered in selection UI
@@ -1010,6 +1168,17 @@ async def print_labels(
 
 
 
+@app.get("/qr/{code}.svg")
+def qr_code(code: str) -> Response:
+    # Private: the route sits behind the login. The QR encodes BASE_URL, which
+    # may change between restarts, so it isn't marked immutable.
+    return Response(
+        content=qr_svg_bytes(f"{BASE_URL}/containers/{code}"),
+        media_type="image/svg+xml",
+        headers={"Cache-Control": "private, max-age=86400"},
+    )
+
+
 @app.get("/containers/{code}", response_class=HTMLResponse)
 def container_view(request: Request, code: str) -> HTMLResponse:
     parts = fetch_parts(container_id=code)
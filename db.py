@@ -1,23 +1,224 @@
 # db.py
 from __future__ import annotations
 
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-import uuid
+from typing import ContextManager, Iterable, Iterator
 
 DB_PATH = Path(__file__).with_name("inventory.db")
 
+# SQLite connections are cheap and requests are I/O-bound, so the pool is sized
+# for concurrency, not CPU count
+POOL_SIZE = 16
+# How long a caller waits for a free pooled connection (matches busy_timeout)
+POOL_TIMEOUT_SECONDS = 5.0
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# The trigram tokenizer gives substring matching (like LIKE '%q%') but can only
+# match needles of at least 3 characters; shorter searches fall back to LIKE.
+FTS_MIN_QUERY_LEN = 3
+
+_fts_enabled = False
+
+# Stored in PRAGMA user_version. Bump on any schema change in init_db (columns,
+# indexes, triggers): a database already at this version skips init_db's writes.
+SCHEMA_VERSION = 1
+
+# Applied once per pooled connection (not per request)
+_CONN_PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA wal_autocheckpoint = 1000;",
+)
+
+
+def _connect(read_only: bool = False) -> sqlite3.Connection:
+    # Pooled connections may be handed to any worker thread
+    # isolation_level=None: autocommit unless a caller issues an explicit BEGIN,
+    # so multi-statement writes control their own transaction boundaries
+    if read_only:
+        # mode=ro: never takes the write lock, so readers don't contend with writers
+        conn = sqlite3.connect(
+            f"{DB_PATH.as_uri()}?mode=ro", uri=True,
+            check_same_thread=False, cached_statements=256, isolation_level=None,
+        )
+    else:
+        conn = sqlite3.connect(
+            DB_PATH, check_same_thread=False, cached_statements=256, isolation_level=None
+        )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA journal_mode = WAL;")
+    for pragma in _CONN_PRAGMAS:
+        conn.execute(pragma)
+    if read_only:
+        conn.execute("PRAGMA query_only = ON;")
     return conn
 
 
+class PoolTimeout(RuntimeError):
+    """No pooled connection became free within POOL_TIMEOUT_SECONDS."""
+
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections.
+
+    Connections are opened lazily (up to ``size``) and reused afterwards, so
+    the per-connection setup is paid once and SQLite's page cache stays warm.
+    When all connections are busy, callers wait up to POOL_TIMEOUT_SECONDS for
+    one to be returned and then get PoolTimeout.
+    """
+
+    def __init__(self, size: int, read_only: bool = False) -> None:
+        self._size = size
+        self._read_only = read_only
+        self._opened = 0
+        self._lock = threading.Lock()
+        # LIFO: prefer the most recently used (hottest) connection
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self._size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return _connect(self._read_only)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT_SECONDS)
+        except queue.Empty:
+            raise PoolTimeout(
+                f"no database connection free after {POOL_TIMEOUT_SECONDS:g}s"
+            ) from None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+
+_pool = ConnectionPool(POOL_SIZE)
+# Separate pool for read-only lookups; opened lazily, i.e. after init_db
+_ro_pool = ConnectionPool(POOL_SIZE, read_only=True)
+
+
+def get_conn() -> ContextManager[sqlite3.Connection]:
+    """Borrow a pooled connection.
+
+    Statements autocommit; an explicit transaction still open on exit is
+    committed on success and rolled back on error.
+    """
+    return _pool.connection()
+
+
+def get_ro_conn() -> ContextManager[sqlite3.Connection]:
+    """Borrow a pooled read-only connection (for queries that never write)."""
+    return _ro_pool.connection()
+
+
+def open_stream_conn() -> sqlite3.Connection:
+    """Open a dedicated read-only connection outside the pools.
+
+    For reads that stay open while waiting on a client (streamed downloads),
+    so a slow or stalled client can't tie up a pooled connection. The caller
+    must close it.
+    """
+    return _connect(read_only=True)
+
+
+# Columns added after the first release: (name, static ALTER statement).
+# init_db adds any that are missing.
+_PARTS_ADDED_COLUMNS = (
+    ("uuid", "ALTER TABLE parts ADD COLUMN uuid TEXT;"),
+    ("image_url", "ALTER TABLE parts ADD COLUMN image_url TEXT;"),
+    ("datasheet_url", "ALTER TABLE parts ADD COLUMN datasheet_url TEXT;"),
+    ("pinout_url", "ALTER TABLE parts ADD COLUMN pinout_url TEXT;"),
+    ("pinout_image_url", "ALTER TABLE parts ADD COLUMN pinout_image_url TEXT;"),
+    ("created_at", "ALTER TABLE parts ADD COLUMN created_at TEXT;"),
+    ("stock_ok_min", "ALTER TABLE parts ADD COLUMN stock_ok_min INTEGER;"),
+    ("stock_warn_min", "ALTER TABLE parts ADD COLUMN stock_warn_min INTEGER;"),
+)
+_TRASH_ADDED_COLUMNS = (
+    ("image_url", "ALTER TABLE parts_trash ADD COLUMN image_url TEXT;"),
+    ("pinout_image_url", "ALTER TABLE parts_trash ADD COLUMN pinout_image_url TEXT;"),
+    ("created_at", "ALTER TABLE parts_trash ADD COLUMN created_at TEXT;"),
+    ("stock_ok_min", "ALTER TABLE parts_trash ADD COLUMN stock_ok_min INTEGER;"),
+    ("stock_warn_min", "ALTER TABLE parts_trash ADD COLUMN stock_warn_min INTEGER;"),
+)
+
+
+def _schema_is_current() -> bool:
+    """Fast path for init_db: check an existing database without a writer.
+
+    Opens the file read-only; if it is already at SCHEMA_VERSION only the FTS
+    availability needs to be determined.
+    """
+    global _fts_enabled
+
+    if not DB_PATH.exists():
+        return False
+    try:
+        conn = sqlite3.connect(f"{DB_PATH.as_uri()}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        if conn.execute("PRAGMA user_version;").fetchone()[0] != SCHEMA_VERSION:
+            return False
+        try:
+            # Fails if the table is missing or this SQLite lacks FTS5
+            conn.execute("SELECT rowid FROM parts_fts LIMIT 0;")
+            _fts_enabled = True
+        except sqlite3.OperationalError:
+            _fts_enabled = False
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
 def init_db() -> None:
+    # UPDATE ... RETURNING (used by the edit handlers) needs SQLite 3.35+
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        raise RuntimeError(f"SQLite >= 3.35 is required (found {sqlite3.sqlite_version})")
+
+    if _schema_is_current():
+        return
+
     with get_conn() as conn:
+        # WAL is persistent in the database file, so it is set here once rather
+        # than on every new connection. Must run outside a transaction.
+        conn.execute("PRAGMA journal_mode = WAL;")
+
+        # Run schema setup and migrations as one write transaction (one commit
+        # instead of one per statement); get_conn() commits or rolls back on exit.
+        conn.execute("BEGIN IMMEDIATE;")
+        schema_version = conn.execute("PRAGMA user_version;").fetchone()[0]
+
         # Core data table
         conn.execute(
             """
@@ -42,9 +243,22 @@ def init_db() -> None:
             );
             """
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_category ON parts(category);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_container ON parts(container_id);")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_desc ON parts(description);")
+        # Matches fetch_parts' ORDER BY so LIMIT is an index walk, not a sort
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_updated ON parts(updated_at DESC, id DESC);")
+        # Category / container filters with the same ORDER BY: equality prefix plus
+        # ordered walk. These supersede the old single-column indexes.
+        new_indexes = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_parts_cat_updated'"
+        ).fetchone() is None
+        conn.execute("DROP INDEX IF EXISTS idx_parts_category;")
+        conn.execute("DROP INDEX IF EXISTS idx_parts_container;")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parts_cat_updated ON parts(category, updated_at DESC, id DESC);"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parts_container_updated ON parts(container_id, updated_at DESC, id DESC);"
+        )
 
         # Lookup tables (used by dropdowns)
         conn.execute(
@@ -111,138 +325,263 @@ def init_db() -> None:
             );
             """
         )
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_parts_trash_deleted_at ON parts_trash(deleted_at);")
+        # Matches fetch_trash's ORDER BY (supersedes the old deleted_at-only index)
+        conn.execute("DROP INDEX IF EXISTS idx_parts_trash_deleted_at;")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_parts_trash_deleted ON parts_trash(deleted_at DESC, trash_id DESC);"
+        )
 
         # ---- Migrations for existing databases ----
-        def _has_column(table: str, column: str) -> bool:
-            rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
-            return any(r[1] == column for r in rows)  # (cid, name, type, notnull, dflt_value, pk)
-
-        # Add missing columns (SQLite supports ADD COLUMN only)
-        for col_def in (
-            "uuid TEXT",
-            "image_url TEXT",
-            "datasheet_url TEXT",
-            "pinout_url TEXT",
-            "pinout_image_url TEXT",
-            "created_at TEXT",
-            "stock_ok_min INTEGER",
-            "stock_warn_min INTEGER",
-        ):
-            col_name = col_def.split()[0]
-            if not _has_column("parts", col_name):
-                conn.execute(f"ALTER TABLE parts ADD COLUMN {col_def};")
-
-        # Backfill created_at for existing rows (best effort)
-        if _has_column("parts", "created_at"):
-            conn.execute(
-                """
-                UPDATE parts
-                SET created_at = updated_at
-                WHERE created_at IS NULL OR TRIM(created_at) = ''
-                """
-            )
+        # Column adds and backfills only need to run once per database; the
+        # schema version in PRAGMA user_version records that they have.
+        if schema_version < SCHEMA_VERSION:
+            def _columns(table: str) -> set[str]:
+                return {r[0] for r in conn.execute("SELECT name FROM pragma_table_info(?)", (table,))}
 
-        for col_def in (
-            "image_url TEXT",
-            "pinout_image_url TEXT",
-            "created_at TEXT",
-            "stock_ok_min INTEGER",
-            "stock_warn_min INTEGER",
-        ):
-            col_name = col_def.split()[0]
-            if not _has_column("parts_trash", col_name):
-                conn.execute(f"ALTER TABLE parts_trash ADD COLUMN {col_def};")
-
-        # Backfill created_at for existing trash rows (best effort)
-        if _has_column("parts_trash", "created_at"):
-            conn.execute(
-                """
-                UPDATE parts_trash
-                SET created_at = updated_at
-                WHERE created_at IS NULL OR TRIM(created_at) = ''
-                """
-            )
+            parts_cols = _columns("parts")
+            trash_cols = _columns("parts_trash")
 
-        # Backfill uuid for existing rows
-        missing = conn.execute(
-            "SELECT id FROM parts WHERE uuid IS NULL OR TRIM(uuid) = ''"
-        ).fetchall()
-        for (part_id,) in missing:
-            conn.execute(
-                "UPDATE parts SET uuid = ? WHERE id = ?",
-                (str(uuid.uuid4()), part_id),
-            )
+            # Add missing columns (SQLite supports ADD COLUMN only). Everything
+            # missing is collected first and added back-to-back in this transaction.
+            for cols, candidates in (
+                (parts_cols, _PARTS_ADDED_COLUMNS),
+                (trash_cols, _TRASH_ADDED_COLUMNS),
+            ):
+                missing = [(name, sql) for name, sql in candidates if name not in cols]
+                for name, sql in missing:
+                    conn.execute(sql)
+                    cols.add(name)
+
+            # Backfill created_at for existing rows (best effort)
+            if "created_at" in parts_cols:
+                conn.execute(
+                    """
+                    UPDATE parts
+                    SET created_at = updated_at
+                    WHERE created_at IS NULL OR TRIM(created_at) = ''
+                    """
+                )
 
-        # Backfill pinout_url from the deprecated pinout_image_url if needed
-        if _has_column("parts", "pinout_image_url") and _has_column("parts", "pinout_url"):
+            # Backfill created_at for existing trash rows (best effort)
+            if "created_at" in trash_cols:
+                conn.execute(
+                    """
+                    UPDATE parts_trash
+                    SET created_at = updated_at
+                    WHERE created_at IS NULL OR TRIM(created_at) = ''
+                    """
+                )
+
+            # Backfill uuid for existing rows: random (version 4) UUIDs generated in
+            # SQL, so this is one statement regardless of how many rows are missing.
+            # Part UUIDs are always written as full strings, so "missing" means NULL
+            # or ''; plain comparisons (no TRIM) let both be looked up in idx_parts_uuid.
             conn.execute(
                 """
                 UPDATE parts
-                SET pinout_url = pinout_image_url
-                WHERE (pinout_url IS NULL OR TRIM(pinout_url) = '')
-                  AND pinout_image_url IS NOT NULL
-                  AND TRIM(pinout_image_url) <> ''
+                SET uuid = lower(
+                    hex(randomblob(4)) || '-' ||
+                    hex(randomblob(2)) || '-4' ||
+                    substr(hex(randomblob(2)), 2) || '-' ||
+                    substr('89ab', 1 + (abs(random()) % 4), 1) ||
+                    substr(hex(randomblob(2)), 2) || '-' ||
+                    hex(randomblob(6))
+                )
+                WHERE uuid IS NULL OR uuid = ''
                 """
             )
 
-        if _has_column("parts_trash", "pinout_image_url") and _has_column("parts_trash", "pinout_url"):
+            # Backfill pinout_url from the deprecated pinout_image_url if needed
+            if "pinout_image_url" in parts_cols and "pinout_url" in parts_cols:
+                conn.execute(
+                    """
+                    UPDATE parts
+                    SET pinout_url = pinout_image_url
+                    WHERE (pinout_url IS NULL OR TRIM(pinout_url) = '')
+                      AND pinout_image_url IS NOT NULL
+                      AND TRIM(pinout_image_url) <> ''
+                    """
+                )
+
+            if "pinout_image_url" in trash_cols and "pinout_url" in trash_cols:
+                conn.execute(
+                    """
+                    UPDATE parts_trash
+                    SET pinout_url = pinout_image_url
+                    WHERE (pinout_url IS NULL OR TRIM(pinout_url) = '')
+                      AND pinout_image_url IS NOT NULL
+                      AND TRIM(pinout_image_url) <> ''
+                    """
+                )
+
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+
+        # Ensure the unique index exists after backfill
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_parts_uuid ON parts(uuid);")
+
+        _init_parts_fts(conn)
+
+        # Give the planner statistics for the new indexes (once, not every startup)
+        if new_indexes:
+            conn.execute("ANALYZE parts;")
+
+
+def _init_parts_fts(conn: sqlite3.Connection) -> None:
+    """Create the search index over parts (external content, synced by triggers)."""
+    global _fts_enabled
+
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'parts_fts'"
+    ).fetchone() is not None
+
+    if not exists:
+        try:
             conn.execute(
                 """
-                UPDATE parts_trash
-                SET pinout_url = pinout_image_url
-                WHERE (pinout_url IS NULL OR TRIM(pinout_url) = '')
-                  AND pinout_image_url IS NOT NULL
-                  AND TRIM(pinout_image_url) <> ''
+                CREATE VIRTUAL TABLE parts_fts USING fts5(
+                    description, notes, subcategory, package, container_id,
+                    content='parts', content_rowid='id', tokenize='trigram'
+                );
                 """
             )
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5/trigram: searches keep using LIKE
+            _fts_enabled = False
+            return
+        # Index rows that existed before the FTS table
+        conn.execute("INSERT INTO parts_fts(parts_fts) VALUES ('rebuild');")
 
-        # Ensure the unique index exists after backfill
-        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_parts_uuid ON parts(uuid);")
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS parts_fts_ai AFTER INSERT ON parts BEGIN
+            INSERT INTO parts_fts(rowid, description, notes, subcategory, package, container_id)
+            VALUES (new.id, new.description, new.notes, new.subcategory, new.package, new.container_id);
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS parts_fts_ad AFTER DELETE ON parts BEGIN
+            INSERT INTO parts_fts(parts_fts, rowid, description, notes, subcategory, package, container_id)
+            VALUES ('delete', old.id, old.description, old.notes, old.subcategory, old.package, old.container_id);
+        END;
+        """
+    )
+    # Only searchable columns re-index; quantity/timestamp updates skip the FTS work
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS parts_fts_au
+        AFTER UPDATE OF description, notes, subcategory, package, container_id ON parts BEGIN
+            INSERT INTO parts_fts(parts_fts, rowid, description, notes, subcategory, package, container_id)
+            VALUES ('delete', old.id, old.description, old.notes, old.subcategory, old.package, old.container_id);
+            INSERT INTO parts_fts(rowid, description, notes, subcategory, package, container_id)
+            VALUES (new.id, new.description, new.notes, new.subcategory, new.package, new.container_id);
+        END;
+        """
+    )
+    _fts_enabled = True
 
 
-def list_containers():
-    with get_conn() as conn:
+def fts_enabled() -> bool:
+    return _fts_enabled
+
+
+# Lookup lists change only through ensure_* below, so they are served from
+# memory and dropped when an insert actually adds a row. Callers must treat the
+# returned lists as read-only.
+_lookup_cache: dict[str, list] = {}
+_lookup_lock = threading.Lock()
+
+
+def _cached_lookup(table: str, load) -> list:
+    with _lookup_lock:
+        rows = _lookup_cache.get(table)
+        if rows is None:
+            rows = _lookup_cache[table] = load()
+        return rows
+
+
+def _invalidate_lookup(table: str) -> None:
+    with _lookup_lock:
+        _lookup_cache.pop(table, None)
+
+
+def _load_containers() -> list:
+    with get_ro_conn() as conn:
         return conn.execute(
             "SELECT code, name FROM containers ORDER BY code"
         ).fetchall()
 
+def _list_names(sql: str) -> list[str]:
+    with get_ro_conn() as conn:
+        # Plain tuples: no sqlite3.Row per name
+        cur = conn.cursor()
+        cur.row_factory = None
+        return [name for (name,) in cur.execute(sql)]
+
+def list_containers():
+    return _cached_lookup("containers", _load_containers)
+
 def list_categories():
-    with get_conn() as conn:
-        rows = conn.execute("SELECT name FROM categories ORDER BY name").fetchall()
-        return [r["name"] if hasattr(r, "keys") else r[0] for r in rows]
+    return _cached_lookup(
+        "categories", lambda: _list_names("SELECT name FROM categories ORDER BY name")
+    )
 
 def list_subcategories():
+    return _cached_lookup(
+        "subcategories", lambda: _list_names("SELECT name FROM subcategories ORDER BY name")
+    )
+
+# Kept as constants so each pooled connection's statement cache gets hits
+_SQL_INSERT_CONTAINER = "INSERT INTO containers(code, name) VALUES (?, ?) ON CONFLICT DO NOTHING"
+_SQL_INSERT_CATEGORY = "INSERT INTO categories(name) VALUES (?) ON CONFLICT DO NOTHING"
+_SQL_INSERT_SUBCATEGORY = "INSERT INTO subcategories(name) VALUES (?) ON CONFLICT DO NOTHING"
+
+def _clean_names(values: Iterable[str]) -> list[str]:
+    # Strip, drop blanks and duplicates (keeping first-seen order)
+    return list(dict.fromkeys(v for v in ((s or "").strip() for s in values) if v))
+
+def _insert_missing(table: str, sql: str, rows: list[tuple]) -> bool:
+    """Insert lookup rows; return True if any were new.
+
+    When every row already existed the (empty) transaction is rolled back
+    instead of committed, so the common case doesn't write to the WAL.
+    """
     with get_conn() as conn:
-        rows = conn.execute("SELECT name FROM subcategories ORDER BY name").fetchall()
-        return [r["name"] if hasattr(r, "keys") else r[0] for r in rows]
+        conn.execute("BEGIN IMMEDIATE;")
+        before = conn.total_changes
+        conn.executemany(sql, rows)
+        inserted = conn.total_changes != before
+        if not inserted:
+            conn.rollback()
+    # After the commit, so a concurrent reader can't re-cache the old list
+    if inserted:
+        _invalidate_lookup(table)
+    return inserted
 
-def ensure_container(code: str):
-    code = (code or "").strip()
-    if not code:
+def ensure_containers(codes: Iterable[str]):
+    codes = _clean_names(codes)
+    if not codes:
         return
-    with get_conn() as conn:
-        conn.execute(
-            "INSERT OR IGNORE INTO containers(code, name) VALUES (?, ?)",
-            (code, code),
-        )
-        conn.commit()
+    _insert_missing("containers", _SQL_INSERT_CONTAINER, [(c, c) for c in codes])
 
-def ensure_category(name: str):
-    name = (name or "").strip()
-    if not name:
+def ensure_categories(names: Iterable[str]):
+    names = _clean_names(names)
+    if not names:
         return
-    with get_conn() as conn:
-        conn.execute(
-            "INSERT OR IGNORE INTO categories(name) VALUES (?)",
-            (name,),
-        )
-        conn.commit()
+    _insert_missing("categories", _SQL_INSERT_CATEGORY, [(n,) for n in names])
 
-def ensure_subcategory(name: str):
-    name = (name or "").strip()
-    if not name:
+def ensure_subcategories(names: Iterable[str]):
+    names = _clean_names(names)
+    if not names:
         return
-    with get_conn() as conn:
-        conn.execute("INSERT OR IGNORE INTO subcategories(name) VALUES (?)", (name,))
-        conn.commit()
+    _insert_missing("subcategories", _SQL_INSERT_SUBCATEGORY, [(n,) for n in names])
+
+def ensure_container(code: str):
+    ensure_containers((code,))
+
+def ensure_category(name: str):
+    ensure_categories((name,))
+
+def ensure_subcategory(name: str):
+    ensure_subcategories((name,))